@@ -7,13 +7,21 @@ diffable environment reports
 __version__ = "0.0.1.dev"
 
 import argparse
+import asyncio
+import base64
+import codecs
+import csv
 import functools
+import hashlib
 import json
 import logging
 import os
+import re
 import shlex
 import subprocess
 import sys
+import tempfile
+import threading
 import warnings
 from contextlib import contextmanager
 from datetime import datetime, timezone
@@ -36,6 +44,14 @@ except AttributeError:
         return " ".join(pipes.quote(arg) for arg in cmd)
 
 
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
 @contextmanager
 def _prefix_on_path(prefix, force=False):
     """Context manager for inserting a $PREFIX onto $PATH
@@ -55,6 +71,90 @@ def _prefix_on_path(prefix, force=False):
         os.environ["PATH"] = path_before
 
 
+@contextmanager
+def _path_from_env(env):
+    """Context manager for temporarily setting $PATH from an env dict
+
+    Used to run synchronous collectors with the $PATH
+    captured for a report while other reports may be collecting
+    on the same event loop.
+    No-op if env is None.
+    """
+    if env is None or "PATH" not in env:
+        yield
+        return
+    path_before = os.environ.get("PATH")
+    os.environ["PATH"] = env["PATH"]
+    try:
+        yield
+    finally:
+        if path_before is None:
+            os.environ.pop("PATH", None)
+        else:
+            os.environ["PATH"] = path_before
+
+
+def _run_sync(coro):
+    """Run a coroutine to completion from synchronous code
+
+    Runs on a fresh event loop,
+    in a separate thread if an event loop is already running in this one
+    (e.g. in an IPython kernel).
+    """
+    # asyncio._get_running_loop is available on all supported Pythons,
+    # get_running_loop() is new in 3.7
+    if asyncio._get_running_loop() is not None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(1) as pool:
+            return pool.submit(_run_sync, coro).result()
+
+    if sys.platform == "win32" and sys.version_info < (3, 8):
+        # subprocesses require the proactor loop on Windows,
+        # which is the default starting with 3.8
+        loop = asyncio.ProactorEventLoop()
+    else:
+        loop = asyncio.new_event_loop()
+
+    # Don't install our loop as the current loop,
+    # so the caller's asyncio state is left alone.
+    # Prior to 3.8 on POSIX, the default child watcher only works
+    # with the current loop of the main thread,
+    # so install it temporarily there and restore the previous loop after.
+    install_loop = (
+        sys.version_info < (3, 8)
+        and sys.platform != "win32"
+        and threading.current_thread() is threading.main_thread()
+    )
+    if install_loop:
+        policy = asyncio.get_event_loop_policy()
+        # private, but reading it doesn't create a new loop like get_event_loop()
+        previous_loop = getattr(getattr(policy, "_local", None), "_loop", None)
+        policy.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            if install_loop:
+                policy.set_event_loop(previous_loop)
+            loop.close()
+
+
+def _async_subprocess_supported():
+    """Whether asyncio subprocesses can be used in the current thread
+
+    Prior to Python 3.8, the default child watcher on POSIX
+    only works with the main thread's event loop.
+    """
+    return (
+        sys.version_info >= (3, 8)
+        or sys.platform == "win32"
+        or threading.current_thread() is threading.main_thread()
+    )
+
+
 @contextmanager
 def nullcontext():
     """Backport contextlib.nullcontext for Python 3.6
@@ -80,6 +180,22 @@ class Level(IntEnum):
         return self.value < other
 
 
+class Cost(IntEnum):
+    """Cost specifies how expensive a collector is to run"""
+
+    cheap = 10  # in-process, e.g. reading environment variables or /proc
+    moderate = 20  # runs subprocesses
+    expensive = 30  # may take a long time, e.g. hashing every installed file
+
+
+# collection profiles: the most expensive cost class each profile runs
+PROFILES = {
+    "fast": Cost.cheap,
+    "default": Cost.moderate,
+    "full": Cost.expensive,
+}
+
+
 class Collector:
     """Base class for a collector
 
@@ -103,12 +219,42 @@ class Collector:
     level: int
     name: str
     path: Path
+    cost = Cost.cheap  # cost class, for selecting collectors with PROFILES
     details = False  # True to force <details> wrapper, e.g. low-priority info
     plain_text_output = True  # if True, get_text_output is wrapped in a code fence
+    timeout = None  # timeout (in seconds) for each subprocess launched by acollect()
+    max_output_bytes = 8 * 1024 * 1024  # truncate command output beyond this size
+    spill_output = False  # if True, save full truncated output to a temporary file
+    # if False, always re-collect, instead of reusing results
+    # from previous reports on the same path and $PATH in this process
+    cache_collected = True
 
     def __init__(self, path):
         """Construct collector for path"""
         self.path = Path(path)
+        self._text_cache = {}
+
+    @property
+    def collected(self):
+        """The collected information
+
+        Assigning a new value invalidates memoized text renderings.
+        Code that modifies `collected` in-place after rendering
+        must re-assign it or call `invalidate_text_cache()`.
+        """
+        try:
+            return self.__dict__["collected"]
+        except KeyError:
+            raise AttributeError("collected") from None
+
+    @collected.setter
+    def collected(self, value):
+        self.__dict__["collected"] = value
+        self.invalidate_text_cache()
+
+    def invalidate_text_cache(self):
+        """Discard memoized text renderings"""
+        self._text_cache = {}
 
     def detect(self):
         """Detect if I'm a relevant data collector
@@ -121,6 +267,9 @@ class Collector:
 
     def _cached_collect(self):
         """Cached caller of .collect()"""
+        if not self.cache_collected:
+            self.collect()
+            return
         if "_collect_cache" not in self.__class__.__dict__:
             setattr(self.__class__, "_collect_cache", {})
         cache = self.__class__._collect_cache
@@ -131,6 +280,23 @@ class Collector:
         else:
             self.collected = cache[cache_key]
 
+    async def _cached_acollect(self, env=None):
+        """Cached caller of .acollect()"""
+        if not self.cache_collected:
+            await self.acollect(env=env)
+            return
+        if "_collect_cache" not in self.__class__.__dict__:
+            setattr(self.__class__, "_collect_cache", {})
+        cache = self.__class__._collect_cache
+        if env is None:
+            env = os.environ
+        cache_key = (self.path, env.get("PATH"))
+        if cache_key not in cache:
+            await self.acollect(env=env)
+            cache[cache_key] = self.collected
+        else:
+            self.collected = cache[cache_key]
+
     def collect(self):
         """Collect our information
 
@@ -141,6 +307,32 @@ class Collector:
         """
         return
 
+    async def acollect(self, env=None):
+        """Collect our information asynchronously
+
+        env: the environment (notably $PATH) to collect with.
+        Default: os.environ
+
+        The default implementation calls synchronous collect(),
+        which is appropriate for cheap, in-process collectors.
+        Collectors that launch subprocesses should override this.
+        """
+        with _path_from_env(env):
+            self.collect()
+
+    def render_text(self, path_replacements=()):
+        """Return my text report with paths squashed
+
+        Memoized per squash configuration until `collected` is re-assigned,
+        so rendering the same report repeatedly
+        only calls get_text_report() once.
+        """
+        cache_key = tuple(tuple(item) for item in path_replacements)
+        if cache_key not in self._text_cache:
+            text = self.get_text_report()
+            self._text_cache[cache_key] = _squash_paths(text, cache_key)
+        return self._text_cache[cache_key]
+
     def get_text_report(self):
         """Return my report as diffable text
 
@@ -194,12 +386,111 @@ class UnrecognizedCollector(Collector):
         return "\n".join(lines)
 
 
-def collect_command_output(cmd, *popen_args, **popen_kwargs):
+class _OutputCapture:
+    """Bounded capture of streamed command output
+
+    Keeps at most `max_bytes` of output in memory:
+    the first and last halves, with a marker in place of what was dropped.
+    Output is decoded incrementally as UTF-8,
+    with invalid bytes replaced.
+
+    If `spill` is True, the complete output is also written to a temporary file,
+    which is kept and referenced in the output only if truncation occurred.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, max_bytes=Collector.max_output_bytes, spill=False):
+        self.max_bytes = max_bytes
+        if max_bytes is None:
+            self._head_limit = None
+            self._tail_limit = 0
+        else:
+            self._head_limit = max_bytes // 2
+            self._tail_limit = max_bytes - self._head_limit
+        self._decoder = codecs.getincrementaldecoder("utf8")(errors="replace")
+        self._head = []
+        self._head_bytes = 0
+        self._tail = bytearray()
+        self.total_bytes = 0
+        self._spill_file = None
+        if spill:
+            self._spill_file = tempfile.NamedTemporaryFile(
+                prefix="envreport-", suffix=".txt", delete=False
+            )
+
+    @property
+    def truncated_bytes(self):
+        """The number of bytes dropped from the middle of the output"""
+        return self.total_bytes - self._head_bytes - len(self._tail)
+
+    def feed(self, chunk):
+        """Add a chunk of bytes to the captured output"""
+        if self._spill_file is not None:
+            self._spill_file.write(chunk)
+        self.total_bytes += len(chunk)
+        if self._head_limit is None or self._head_bytes < self._head_limit:
+            if self._head_limit is not None:
+                room = self._head_limit - self._head_bytes
+                head_chunk, chunk = chunk[:room], chunk[room:]
+            else:
+                head_chunk, chunk = chunk, b""
+            self._head.append(self._decoder.decode(head_chunk))
+            self._head_bytes += len(head_chunk)
+        if chunk:
+            self._tail += chunk
+            excess = len(self._tail) - self._tail_limit
+            if excess > 0:
+                del self._tail[:excess]
+
+    def read_from(self, stream):
+        """Capture everything from a blocking binary stream"""
+        for chunk in iter(functools.partial(stream.read, self.chunk_size), b""):
+            self.feed(chunk)
+
+    def finish(self):
+        """Return the captured text, with a marker if it was truncated"""
+        truncated = self.truncated_bytes
+        if not truncated:
+            text = "".join(self._head) + self._decoder.decode(
+                bytes(self._tail), final=True
+            )
+        else:
+            tail = self._tail
+            # don't start the tail in the middle of a multi-byte character
+            start = 0
+            while start < min(len(tail), 4) and (tail[start] & 0xC0) == 0x80:
+                start += 1
+            text = (
+                "".join(self._head)
+                + self._decoder.decode(b"", final=True)
+                + f"\n[... truncated {truncated} of {self.total_bytes} bytes ...]\n"
+                + bytes(tail[start:]).decode("utf8", "replace")
+            )
+        self._head = []
+        self._tail = bytearray()
+        if self._spill_file is not None:
+            self._spill_file.close()
+            if truncated:
+                text += f"\n[full output saved to {self._spill_file.name}]"
+            else:
+                os.remove(self._spill_file.name)
+            self._spill_file = None
+        return text
+
+
+def collect_command_output(
+    cmd, *popen_args, max_bytes=Collector.max_output_bytes, spill=False, **popen_kwargs
+):
     """Run a command and collect its output
 
     Always returns a string, even on failure
 
-    arguments are passed through to Popen
+    Output is streamed and truncated to at most `max_bytes`
+    (None for no limit).
+    If `spill` is True, truncated output is saved in full to a temporary file.
+
+    other arguments are passed through to Popen
     """
 
     popen_kwargs["stdout"] = subprocess.PIPE
@@ -208,16 +499,108 @@ def collect_command_output(cmd, *popen_args, **popen_kwargs):
     log.debug(f"Collecting command output: `{cmd_s}`")
     try:
         with subprocess.Popen(cmd, *popen_args, **popen_kwargs) as p:
-            stdout, stderr = p.communicate()
-            stdout = stdout.decode("utf8")
-            if stderr:
-                stdout += "\n" + stderr.decode("utf8")
+            capture = _OutputCapture(max_bytes, spill)
+            stderr_capture = stderr_thread = None
+            if p.stderr is not None:
+                # drain stderr in the background to avoid filling the pipe
+                stderr_capture = _OutputCapture(max_bytes)
+                stderr_thread = threading.Thread(
+                    target=stderr_capture.read_from, args=(p.stderr,), daemon=True
+                )
+                stderr_thread.start()
+            capture.read_from(p.stdout)
+            stdout = capture.finish()
+            if stderr_thread is not None:
+                stderr_thread.join()
+                stderr = stderr_capture.finish()
+                if stderr:
+                    stdout += "\n" + stderr
             return stdout.rstrip("\n")
     except Exception as e:
         log.error(f"Error running {cmd}: {e}")
         return str(e)
 
 
+async def acollect_command_output(
+    cmd, *, timeout=None, env=None, max_bytes=Collector.max_output_bytes, spill=False
+):
+    """Run a command asynchronously and collect its output
+
+    Like collect_command_output, always returns a string,
+    even on failure or timeout,
+    and output is truncated to at most `max_bytes`.
+
+    The process is killed if the timeout expires or we are cancelled.
+
+    Where asyncio subprocesses are unavailable
+    (Python < 3.8 on POSIX, outside the main thread),
+    falls back to blocking collect_command_output() in an executor,
+    without timeout or cancellation.
+    """
+    if not _async_subprocess_supported():
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None,
+            functools.partial(
+                collect_command_output, cmd, env=env, max_bytes=max_bytes, spill=spill
+            ),
+        )
+    cmd_s = shlex_join(cmd)
+    log.debug(f"Collecting command output: `{cmd_s}`")
+    try:
+        p = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=env,
+        )
+    except Exception as e:
+        log.error(f"Error running {cmd}: {e}")
+        return str(e)
+
+    capture = _OutputCapture(max_bytes, spill)
+
+    async def drain():
+        while True:
+            chunk = await p.stdout.read(capture.chunk_size)
+            if not chunk:
+                break
+            capture.feed(chunk)
+        await p.wait()
+
+    try:
+        await asyncio.wait_for(drain(), timeout)
+    except asyncio.CancelledError:
+        # CancelledError is an Exception subclass prior to Python 3.8
+        _kill_process(p)
+        capture.finish()
+        # reap the killed process, even if we are cancelled again
+        await asyncio.shield(p.wait())
+        raise
+    except asyncio.TimeoutError:
+        log.error(f"Timeout after {timeout}s running {cmd}")
+        _kill_process(p)
+        await p.wait()
+        stdout = capture.finish().rstrip("\n")
+        return f"{stdout}\nTimeout after {timeout}s".lstrip("\n")
+    except Exception as e:
+        log.error(f"Error running {cmd}: {e}")
+        _kill_process(p)
+        await p.wait()
+        capture.finish()
+        return str(e)
+    return capture.finish().rstrip("\n")
+
+
+def _kill_process(p):
+    """Kill an asyncio subprocess, if it's still running"""
+    if p.returncode is None:
+        try:
+            p.kill()
+        except ProcessLookupError:
+            pass
+
+
 class CommandCollector(Collector):
     """Collector base class
 
@@ -228,6 +611,9 @@ class CommandCollector(Collector):
     (either as class attribute or instance property)
     """
 
+    cost = Cost.moderate
+    timeout = 120
+
     @property
     def command(self):
         """Subclasses must specify a command attribute or property"""
@@ -244,7 +630,24 @@ class CommandCollector(Collector):
         """
         self.collected = {
             "command": self.command,
-            "output": collect_command_output(self.command),
+            "output": collect_command_output(
+                self.command,
+                max_bytes=self.max_output_bytes,
+                spill=self.spill_output,
+            ),
+        }
+
+    async def acollect(self, env=None):
+        """Collect command and its output asynchronously"""
+        self.collected = {
+            "command": self.command,
+            "output": await acollect_command_output(
+                self.command,
+                timeout=self.timeout,
+                env=env,
+                max_bytes=self.max_output_bytes,
+                spill=self.spill_output,
+            ),
         }
 
     def get_text_report(self):
@@ -254,6 +657,211 @@ class CommandCollector(Collector):
         return f"$ {cmd_string}\n{output}"
 
 
+def _canonical_name(name):
+    """Normalize a package name (PEP 503)"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _format_columns(header, rows, prefix="", underline=False):
+    """Format rows as aligned, space-separated columns
+
+    Trailing empty columns are omitted.
+    prefix is added to the header line, e.g. '# ' for conda-style output.
+    If underline is True, add a line of dashes under the header,
+    like `pip list`.
+    """
+    rows = [[prefix + header[0]] + list(header[1:])] + [list(row) for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    if underline:
+        rows.insert(1, ["-" * width for width in widths])
+    lines = []
+    for row in rows:
+        cells = [cell.ljust(width) for cell, width in zip(row, widths)]
+        lines.append(" ".join(cells).rstrip())
+    return lines
+
+
+class PackageTable:
+    """A normalized list of installed packages
+
+    Stored by column (parallel lists of interned strings)
+    to keep many reports cheap to hold in memory and compare.
+
+    Rows are sorted by package name.
+    """
+
+    columns = ("name", "version", "build", "channel", "installer")
+
+    def __init__(self, name=(), version=(), build=(), channel=(), installer=()):
+        """Construct from parallel columns"""
+        self.name = [sys.intern(s) for s in name]
+        n = len(self.name)
+        for column, values in (
+            ("version", version),
+            ("build", build),
+            ("channel", channel),
+            ("installer", installer),
+        ):
+            values = [sys.intern(s) for s in values] or [""] * n
+            if len(values) != n:
+                raise ValueError(
+                    f"Column {column!r} has {len(values)} values, expected {n}"
+                )
+            setattr(self, column, values)
+
+    @classmethod
+    def from_records(cls, records):
+        """Construct from an iterable of dicts with keys in `columns`"""
+        rows = sorted(
+            (
+                record["name"],
+                record.get("version") or "",
+                record.get("build") or "",
+                record.get("channel") or "",
+                record.get("installer") or "",
+            )
+            for record in records
+        )
+        if not rows:
+            return cls()
+        return cls(*zip(*rows))
+
+    def __len__(self):
+        """The number of packages"""
+        return len(self.name)
+
+    def __iter__(self):
+        """Iterate over rows as tuples, in the order of `columns`"""
+        return zip(*(getattr(self, column) for column in self.columns))
+
+    def __eq__(self, other):
+        """Compare tables column by column"""
+        if not isinstance(other, PackageTable):
+            return NotImplemented
+        return all(
+            getattr(self, column) == getattr(other, column) for column in self.columns
+        )
+
+    def records(self):
+        """Iterate over rows as dicts"""
+        for row in self:
+            yield dict(zip(self.columns, row))
+
+    def to_dict(self):
+        """Serialize to a compact JSONable dict
+
+        Columns with the same value for every package
+        are stored as that single string.
+        """
+        d = {"name": self.name}
+        for column in self.columns[1:]:
+            values = getattr(self, column)
+            if values and all(value == values[0] for value in values):
+                d[column] = values[0]
+            else:
+                d[column] = values
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        """Reconstruct from to_dict() output"""
+        n = len(d["name"])
+        columns = {}
+        for column in cls.columns:
+            values = d.get(column, "")
+            if isinstance(values, str):
+                values = [values] * n
+            columns[column] = values
+        return cls(**columns)
+
+
+class PackageListCollector(CommandCollector):
+    """Base class for collectors of package lists
+
+    Subclasses define a `command` producing JSON output,
+    `parse_packages()` to turn that output into records for `PackageTable`,
+    and `format_packages()` to render the table as text.
+
+    If the output cannot be parsed,
+    the raw command output is kept and reported instead.
+    """
+
+    def parse_packages(self, data):
+        """Turn parsed JSON output into an iterable of package records"""
+        raise NotImplementedError("PackageListCollector subclasses must parse output")
+
+    def format_packages(self, packages):
+        """Render a PackageTable as a list of text lines"""
+        raise NotImplementedError("PackageListCollector subclasses must format output")
+
+    def _load_json(self, output):
+        """Find and load the JSON list in command output
+
+        Output may include warnings from stderr before or after the JSON.
+        """
+        decoder = json.JSONDecoder()
+        for match in re.finditer(r"^\[", output, re.MULTILINE):
+            try:
+                data, _ = decoder.raw_decode(output, match.start())
+            except ValueError:
+                continue
+            if isinstance(data, list):
+                return data
+        raise ValueError("No JSON list found in output")
+
+    def _parse_collected(self):
+        """Replace collected raw output with a PackageTable, if possible"""
+        output = self.collected["output"]
+        try:
+            packages = PackageTable.from_records(
+                self.parse_packages(self._load_json(output))
+            )
+        except Exception as e:
+            log.warning(f"Failed to parse {self.name} output, keeping raw text: {e}")
+            return
+        self.collected = {
+            "command": self.collected["command"],
+            "packages": packages,
+        }
+
+    def collect(self):
+        """Collect command output and parse it into a PackageTable"""
+        super().collect()
+        self._parse_collected()
+
+    async def acollect(self, env=None):
+        """Collect command output asynchronously and parse it into a PackageTable"""
+        await super().acollect(env=env)
+        self._parse_collected()
+
+    def get_text_report(self):
+        """Render the package table, or raw output if it couldn't be parsed"""
+        if "packages" not in self.collected:
+            return super().get_text_report()
+        cmd_string = shlex_join(self.collected["command"])
+        lines = [f"$ {cmd_string}"]
+        lines.extend(self.format_packages(self.collected["packages"]))
+        return "\n".join(lines)
+
+    def to_dict(self):
+        """Serialize, storing the package table by column"""
+        d = super().to_dict()
+        if "packages" in self.collected:
+            d["collected"] = dict(self.collected)
+            d["collected"]["packages"] = self.collected["packages"].to_dict()
+        return d
+
+    @classmethod
+    def from_dict(cls, path, d):
+        """Reconstruct, loading the columnar package table"""
+        self = super().from_dict(path, d)
+        if "packages" in self.collected:
+            collected = dict(self.collected)
+            collected["packages"] = PackageTable.from_dict(collected["packages"])
+            self.collected = collected
+        return self
+
+
 class CondaInfoCollector(CommandCollector):
     """Collect `conda info`"""
 
@@ -263,18 +871,41 @@ class CondaInfoCollector(CommandCollector):
     details = True
 
 
-class CondaListCollector(CommandCollector):
+class CondaListCollector(PackageListCollector):
     """
-    Collect conda package list with `conda --list`
+    Collect conda package list with `conda list --json`
 
     Only run if we are in a conda environment
     """
 
     level = Level.python
     name = "conda list"
-    # TODO: normalize output
 
-    command = ["conda", "list"]
+    command = ["conda", "list", "--json"]
+
+    def parse_packages(self, data):
+        """Normalize `conda list --json` entries"""
+        for pkg in data:
+            channel = pkg.get("channel") or ""
+            yield {
+                "name": pkg["name"],
+                "version": pkg["version"],
+                "build": pkg.get("build_string") or "",
+                "channel": channel,
+                "installer": "pip" if channel == "pypi" else "conda",
+            }
+
+    def format_packages(self, packages):
+        """Format like `conda list`"""
+        lines = [f"# packages in environment at {self.path}:", "#"]
+        lines.extend(
+            _format_columns(
+                ("Name", "Version", "Build", "Channel"),
+                (row[:4] for row in packages),
+                prefix="# ",
+            )
+        )
+        return lines
 
     def detect(self):
         """Only run this if we are in a conda environment"""
@@ -295,6 +926,8 @@ class SystemReportCollector(Collector):
 
     level = Level.system
     name = "system-report"
+    cost = Cost.moderate
+    timeout = 120
     commands = [
         ["hostname"],
         ["uname", "-a"],
@@ -313,7 +946,11 @@ class SystemReportCollector(Collector):
         command_outputs = self.collected["commands"] = []
         for command in self.commands:
             if which(command[0]):
-                out = collect_command_output(command)
+                out = collect_command_output(
+                    command,
+                    max_bytes=self.max_output_bytes,
+                    spill=self.spill_output,
+                )
                 command_outputs.append(
                     {
                         "command": command,
@@ -321,6 +958,34 @@ class SystemReportCollector(Collector):
                     }
                 )
 
+    async def acollect(self, env=None):
+        """Collect all command outputs concurrently"""
+        search_path = None if env is None else env.get("PATH")
+        commands = [
+            command for command in self.commands if which(command[0], path=search_path)
+        ]
+        outputs = await asyncio.gather(
+            *(
+                acollect_command_output(
+                    command,
+                    timeout=self.timeout,
+                    env=env,
+                    max_bytes=self.max_output_bytes,
+                    spill=self.spill_output,
+                )
+                for command in commands
+            )
+        )
+        self.collected = {
+            "commands": [
+                {
+                    "command": command,
+                    "output": out,
+                }
+                for command, out in zip(commands, outputs)
+            ]
+        }
+
     def get_text_report(self):
         """Collect each item"""
         lines = []
@@ -350,6 +1015,218 @@ class AptCollector(CommandCollector):
     ]
 
 
+def _read_text(path):
+    """Read a small text file, returning None if it can't be read"""
+    try:
+        with open(path) as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def _format_bytes(n):
+    """Format a number of bytes in human-readable binary units"""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if n < 1024:
+            break
+        n /= 1024
+    else:
+        unit = "TiB"
+    if unit == "B":
+        return f"{n} B"
+    return f"{n:.1f} {unit}"
+
+
+class ResourcesCollector(Collector):
+    """Collect CPU, memory, cgroup limits and load
+
+    Reads /proc and /sys directly, without launching subprocesses.
+
+    Volatile values are left out or normalized so that reports remain diffable:
+    only memory capacity (not availability) is recorded,
+    and load is reduced to a coarse level relative to the usable CPUs.
+    """
+
+    level = Level.system
+    name = "resources"
+
+    # roots for /proc and /sys, to allow testing on captured files
+    proc_root = "/proc"
+    sys_root = "/sys"
+
+    def detect(self):
+        """Run if /proc/meminfo can be found (i.e. Linux)"""
+        return os.path.exists(os.path.join(self.proc_root, "meminfo"))
+
+    def _proc(self, *parts):
+        return _read_text(os.path.join(self.proc_root, *parts))
+
+    def _sys(self, *parts):
+        return _read_text(os.path.join(self.sys_root, *parts))
+
+    def _collect_cpu(self):
+        """Parse /proc/cpuinfo and CPU affinity"""
+        cpu = {"count": os.cpu_count()}
+        cpuinfo = self._proc("cpuinfo") or ""
+        processors = 0
+        cores = set()
+        physical_id = None
+        for line in cpuinfo.splitlines():
+            key, _, value = line.partition(":")
+            key = key.strip()
+            value = value.strip()
+            if key == "processor":
+                processors += 1
+            elif key in {"model name", "Model", "cpu model"} and "model" not in cpu:
+                cpu["model"] = value
+            elif key == "physical id":
+                physical_id = value
+            elif key == "core id":
+                cores.add((physical_id, value))
+        if processors:
+            cpu["processors"] = processors
+        if cores:
+            cpu["cores"] = len(cores)
+        if hasattr(os, "sched_getaffinity"):
+            cpu["affinity"] = len(os.sched_getaffinity(0))
+        return cpu
+
+    def _collect_memory(self):
+        """Parse memory capacity from /proc/meminfo
+
+        Free/available memory changes on every run, so it is not recorded.
+        """
+        memory = {}
+        meminfo = self._proc("meminfo") or ""
+        for line in meminfo.splitlines():
+            key, _, value = line.partition(":")
+            fields = value.split()
+            if key not in {"MemTotal", "SwapTotal"} or not fields:
+                continue
+            n = int(fields[0])
+            if fields[1:] == ["kB"]:
+                n *= 1024
+            memory[key] = n
+        return memory
+
+    def _collect_load(self, cpus):
+        """Bucket the 15-minute load average from /proc/loadavg per usable CPU
+
+        Returns 'low' (< 0.5 per CPU), 'moderate' (< 1), or 'saturated',
+        since raw load averages change on every run.
+        """
+        loadavg = self._proc("loadavg")
+        if not loadavg:
+            return None
+        load_per_cpu = float(loadavg.split()[2]) / (cpus or 1)
+        if load_per_cpu < 0.5:
+            return "low"
+        elif load_per_cpu < 1:
+            return "moderate"
+        else:
+            return "saturated"
+
+    def _cgroup_file(self, mounts, own_cgroup, filename):
+        """Read the first available cgroup file
+
+        Tries our own cgroup within each mount, then the mount's root
+        (e.g. in a container with its own cgroup namespace).
+        """
+        cgroup_dirs = [own_cgroup, "/"] if own_cgroup.strip("/") else ["/"]
+        for mount in mounts:
+            for cgroup_dir in cgroup_dirs:
+                relative = f"{mount}/{cgroup_dir}/{filename}".strip("/")
+                text = self._sys("fs", "cgroup", *filter(None, relative.split("/")))
+                if text is not None:
+                    return text.strip()
+        return None
+
+    def _collect_cgroup(self):
+        """Collect cgroup v1 or v2 CPU and memory limits"""
+        own_cgroups = {}
+        for line in (self._proc("self", "cgroup") or "").splitlines():
+            parts = line.split(":", 2)
+            if len(parts) == 3:
+                for controller in parts[1].split(","):
+                    own_cgroups[controller] = parts[2]
+
+        cgroup = {}
+        if self._sys("fs", "cgroup", "cgroup.controllers") is not None:
+            cgroup["version"] = 2
+            own = own_cgroups.get("", "/")
+            cpu_max = self._cgroup_file([""], own, "cpu.max")
+            memory_max = self._cgroup_file([""], own, "memory.max")
+            cpu_stat = self._cgroup_file([""], own, "cpu.stat")
+            if cpu_max:
+                quota, _, period = cpu_max.partition(" ")
+                if quota != "max":
+                    cgroup["cpu_limit"] = round(int(quota) / int(period), 2)
+            if memory_max and memory_max != "max":
+                cgroup["memory_limit"] = int(memory_max)
+        elif own_cgroups:
+            cgroup["version"] = 1
+            cpu_mounts = ["cpu,cpuacct", "cpu"]
+            own_cpu = own_cgroups.get("cpu", "/")
+            quota = self._cgroup_file(cpu_mounts, own_cpu, "cpu.cfs_quota_us")
+            period = self._cgroup_file(cpu_mounts, own_cpu, "cpu.cfs_period_us")
+            cpu_stat = self._cgroup_file(cpu_mounts, own_cpu, "cpu.stat")
+            if quota and period and int(quota) > 0:
+                cgroup["cpu_limit"] = round(int(quota) / int(period), 2)
+            memory_limit = self._cgroup_file(
+                ["memory"], own_cgroups.get("memory", "/"), "memory.limit_in_bytes"
+            )
+            # unlimited is reported as a very large number
+            if memory_limit and int(memory_limit) < 2**62:
+                cgroup["memory_limit"] = int(memory_limit)
+        else:
+            return None
+        if cpu_stat:
+            for line in cpu_stat.splitlines():
+                key, _, value = line.partition(" ")
+                if key == "nr_throttled":
+                    # volatile counter: only record whether we've been throttled
+                    cgroup["throttled"] = int(value) > 0
+        return cgroup
+
+    def collect(self):
+        """Collect cpu, memory, load and cgroup info"""
+        cpu = self._collect_cpu()
+        self.collected = {
+            "cpu": cpu,
+            "memory": self._collect_memory(),
+            "load": self._collect_load(cpu.get("affinity") or cpu["count"]),
+            "cgroup": self._collect_cgroup(),
+        }
+
+    def get_text_report(self):
+        """Report resources as `key: value` lines"""
+        lines = []
+        cpu = self.collected["cpu"]
+        for key in ("model", "processors", "cores", "count", "affinity"):
+            if key in cpu:
+                lines.append(f"cpu {key}: {cpu[key]}")
+        memory = self.collected["memory"]
+        for key, label in (
+            ("MemTotal", "total"),
+            ("SwapTotal", "swap"),
+        ):
+            if key in memory:
+                lines.append(f"memory {label}: {_format_bytes(memory[key])}")
+        load = self.collected["load"]
+        if load:
+            lines.append(f"load (15 minutes, per usable cpu): {load}")
+        cgroup = self.collected["cgroup"]
+        if cgroup:
+            lines.append(f"cgroup version: {cgroup['version']}")
+            lines.append(f"cgroup cpu limit: {cgroup.get('cpu_limit', 'none')}")
+            memory_limit = cgroup.get("memory_limit")
+            memory_limit = _format_bytes(memory_limit) if memory_limit else "none"
+            lines.append(f"cgroup memory limit: {memory_limit}")
+            if "throttled" in cgroup:
+                lines.append(f"cgroup cpu throttled: {cgroup['throttled']}")
+        return "\n".join(lines)
+
+
 class WhichCollector(Collector):
     """Resolve paths to common executables with $(which)"""
 
@@ -465,26 +1342,269 @@ class PythonSiteCollector(CommandCollector):
     command = ["python3", "-m", "site"]
 
 
-class PipCollector(CommandCollector):
-    """Collect pip package list"""
+def _file_digest(path, algorithm):
+    """Compute a RECORD-style digest of a file: urlsafe base64, no padding"""
+    h = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(functools.partial(f.read, 1024 * 1024), b""):
+            h.update(chunk)
+    return base64.urlsafe_b64encode(h.digest()).rstrip(b"=").decode("ascii")
+
+
+def _verify_record(site_packages, dist_info, stat_cache):
+    """Verify the files of one distribution against its RECORD
+
+    stat_cache maps absolute paths to [mtime_ns, size, algorithm, digest],
+    and is only read here.
+    Digests are only computed for files whose stat doesn't match the cache.
+
+    Returns a dict with the distribution name,
+    relative paths of modified and missing files,
+    all recorded paths, and new stat-cache entries.
+    """
+    result = {
+        "name": dist_info.name[: -len(".dist-info")],
+        "checked": 0,
+        "modified": [],
+        "missing": [],
+        "recorded": set(),
+        "cache": {},
+    }
+    with (dist_info / "RECORD").open(newline="", encoding="utf8") as f:
+        rows = list(csv.reader(f))
+    for row in rows:
+        if not row:
+            continue
+        rel_path = row[0]
+        result["recorded"].add(os.path.normpath(rel_path))
+        if len(row) < 2 or "=" not in row[1]:
+            # RECORD itself and generated files (e.g. .pyc) have no hash
+            continue
+        algorithm, expected = row[1].split("=", 1)
+        path = os.path.normpath(os.path.join(str(site_packages), rel_path))
+        result["checked"] += 1
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            result["missing"].append(rel_path)
+            continue
+        cached = stat_cache.get(path)
+        if cached and cached[:3] == [st.st_mtime_ns, st.st_size, algorithm]:
+            digest = cached[3]
+        else:
+            try:
+                digest = _file_digest(path, algorithm)
+            except (OSError, ValueError) as e:
+                log.warning(f"Failed to hash {path}: {e}")
+                result["modified"].append(rel_path)
+                continue
+            result["cache"][path] = [st.st_mtime_ns, st.st_size, algorithm, digest]
+        if digest != expected:
+            result["modified"].append(rel_path)
+    return result
+
+
+class RecordCollector(Collector):
+    """Verify installed files against each distribution's RECORD
+
+    Reports files that have been modified or removed since installation,
+    and files in installed packages that no distribution recorded.
+
+    Digests are cached by (path, mtime, size) in `cache_dir`,
+    so only changed files are re-hashed on subsequent runs.
+    """
 
-    name = "pip"
     level = Level.python
+    name = "site-packages integrity"
+    cost = Cost.expensive
+    details = True
+    # files may change between reports in a long-running process,
+    # and the stat cache already makes re-verification cheap
+    cache_collected = False
+
+    # default: $XDG_CACHE_HOME/envreport or ~/.cache/envreport
+    cache_dir = None
+    # thread pool size for verifying distributions; None for the executor default
+    max_workers = None
+
+    def _site_packages_dirs(self):
+        """Find site-packages directories in our prefix"""
+        dirs = sorted(self.path.glob("lib/python*/site-packages"))
+        windows_site = self.path / "Lib" / "site-packages"
+        if windows_site.is_dir():
+            dirs.append(windows_site)
+        return [d for d in dirs if d.is_dir()]
+
+    def detect(self):
+        """Run if our prefix has a site-packages directory"""
+        return bool(self._site_packages_dirs())
+
+    def _cache_path(self, site_packages):
+        """The stat-cache file for a site-packages directory"""
+        cache_dir = self.cache_dir
+        if cache_dir is None:
+            cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+            cache_dir = Path(cache_home) / "envreport"
+        key = hashlib.sha256(str(site_packages.resolve()).encode("utf8")).hexdigest()
+        return Path(cache_dir) / f"record-{key[:16]}.json"
+
+    def _load_cache(self, cache_path):
+        """Load the stat cache, returning an empty cache on any failure"""
+        try:
+            with cache_path.open() as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            log.warning(f"Ignoring invalid cache {cache_path}: {e}")
+            return {}
+
+    def _save_cache(self, cache_path, cache):
+        """Save the stat cache, atomically replacing the previous one"""
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+            with tmp_path.open("w") as f:
+                json.dump(cache, f)
+            os.replace(str(tmp_path), str(cache_path))
+        except OSError as e:
+            log.warning(f"Failed to save cache {cache_path}: {e}")
+
+    def _unrecorded(self, site_packages, recorded):
+        """Find files in recorded top-level package directories that no RECORD lists"""
+        top_levels = set()
+        for rel_path in recorded:
+            # RECORD may list absolute paths, e.g. data files outside the prefix
+            if os.path.isabs(rel_path) or os.path.splitdrive(rel_path)[0]:
+                continue
+            parts = Path(rel_path).parts
+            if len(parts) > 1 and parts[0] != os.pardir:
+                top_levels.add(parts[0])
+        site_packages_real = os.path.realpath(str(site_packages))
+        unrecorded = []
+        for top_level in sorted(top_levels):
+            if top_level.endswith((".dist-info", ".data")):
+                continue
+            top_dir = site_packages / top_level
+            top_dir_real = os.path.realpath(str(top_dir))
+            if (
+                os.path.dirname(top_dir_real) != site_packages_real
+                or not top_dir.is_dir()
+            ):
+                # only walk package directories directly in site-packages
+                continue
+            for dirpath, dirnames, filenames in os.walk(str(top_dir)):
+                # bytecode caches are regenerated, and rarely recorded
+                dirnames[:] = [d for d in dirnames if d != "__pycache__"]
+                for filename in filenames:
+                    if filename.endswith((".pyc", ".pyo")):
+                        continue
+                    rel_path = os.path.relpath(
+                        os.path.join(dirpath, filename), str(site_packages)
+                    )
+                    if rel_path not in recorded:
+                        unrecorded.append(rel_path)
+        return sorted(unrecorded)
+
+    def _verify_site_packages(self, site_packages):
+        """Verify all distributions in one site-packages directory"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        cache_path = self._cache_path(site_packages)
+        stat_cache = self._load_cache(cache_path)
+        dist_infos = sorted(site_packages.glob("*.dist-info"))
+        no_record = [d.name for d in dist_infos if not (d / "RECORD").exists()]
+        dist_infos = [d for d in dist_infos if (d / "RECORD").exists()]
+
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            results = list(
+                pool.map(
+                    lambda d: _verify_record(site_packages, d, stat_cache), dist_infos
+                )
+            )
+
+        recorded = set()
+        new_cache = {}
+        summary = {
+            "path": str(site_packages),
+            "distributions": len(results),
+            "files": 0,
+            "modified": [],
+            "missing": [],
+            "no-record": no_record,
+        }
+        for result in results:
+            summary["files"] += result["checked"]
+            recorded.update(result["recorded"])
+            for path in result["recorded"]:
+                abs_path = os.path.normpath(os.path.join(str(site_packages), path))
+                if abs_path in stat_cache:
+                    new_cache[abs_path] = stat_cache[abs_path]
+            new_cache.update(result["cache"])
+            for key in ("modified", "missing"):
+                summary[key].extend(
+                    f"{result['name']}: {path}" for path in sorted(result[key])
+                )
+        summary["unrecorded"] = self._unrecorded(site_packages, recorded)
+        # only keep entries for currently recorded files
+        if new_cache != stat_cache:
+            self._save_cache(cache_path, new_cache)
+        return summary
 
-    # TODO: try parsing/normalizing pip
-    # pip list --format json
-    command = ["python3", "-m", "pip", "list"]
+    async def acollect(self, env=None):
+        """Verify in an executor, to avoid blocking the event loop"""
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.collect)
 
+    def collect(self):
+        """Verify each site-packages directory in our prefix"""
+        self.collected = {
+            "site-packages": [
+                self._verify_site_packages(site_packages)
+                for site_packages in self._site_packages_dirs()
+            ]
+        }
+
+    def get_text_report(self):
+        """Summary and list of problems in each site-packages"""
+        lines = []
+        for summary in self.collected["site-packages"]:
+            lines.append(f"{summary['path']}:")
+            lines.append(f"  distributions: {summary['distributions']}")
+            lines.append(f"  files verified: {summary['files']}")
+            for key in ("modified", "missing", "unrecorded", "no-record"):
+                items = summary[key]
+                lines.append(f"  {key}: {len(items)}")
+                lines.extend(f"    {item}" for item in items)
+            lines.append("")
+        return "\n".join(lines[:-1])
 
-def _with_prefix(method):
-    """Decorator for running a method with $PREFIX/bin first on PATH"""
 
-    @functools.wraps(method)
-    def wrapped(self, *args, **kwargs):
-        with self._env_context:
-            return method(self, *args, **kwargs)
+class PipCollector(PackageListCollector):
+    """Collect pip package list"""
+
+    name = "pip"
+    level = Level.python
 
-    return wrapped
+    # --verbose adds 'installer' to json output
+    command = ["python3", "-m", "pip", "list", "--format", "json", "--verbose"]
+
+    def parse_packages(self, data):
+        """Normalize `pip list --format json` entries"""
+        for pkg in data:
+            yield {
+                "name": _canonical_name(pkg["name"]),
+                "version": pkg["version"],
+                "installer": pkg.get("installer") or "",
+            }
+
+    def format_packages(self, packages):
+        """Format like `pip list`"""
+        return _format_columns(
+            ("Package", "Version"),
+            (row[:2] for row in packages),
+            underline=True,
+        )
 
 
 class EnvReport:
@@ -515,10 +1635,11 @@ class EnvReport:
         """
         if path is None:
             path = discover_path()
-            self._env_context = nullcontext()
+            self._env_context = nullcontext
         else:
             path = Path(path)
-            self._env_context = _prefix_on_path(path)
+            # a new context manager for each use, so we can collect more than once
+            self._env_context = functools.partial(_prefix_on_path, path)
         self.path = path
         self._discover_collectors()
 
@@ -539,24 +1660,95 @@ class EnvReport:
             ):
                 collectors[obj.name] = obj
 
-    @_with_prefix
-    def collect(self):
-        """Run all collectors"""
-        self.collect_date = datetime.now(timezone.utc).isoformat()
-        self.collectors = {}
-        for collector_class in sorted(
-            self._collector_classes.values(), key=lambda cls: (cls.level, cls.name)
-        ):
-            try:
-                collector = collector_class(path=self.path)
-                if not collector.detect():
-                    log.debug(f"Not collecting {collector.name}")
+    def collect(
+        self, *, max_concurrency=4, profile="default", update=False, timeout=None
+    ):
+        """Run all collectors
+
+        Synchronous wrapper around acollect()
+        """
+        return _run_sync(
+            self.acollect(
+                max_concurrency=max_concurrency,
+                profile=profile,
+                update=update,
+                timeout=timeout,
+            )
+        )
+
+    async def acollect(
+        self, *, max_concurrency=4, profile="default", update=False, timeout=None
+    ):
+        """Run all collectors asynchronously
+
+        profile selects which collectors run by their cost class
+        (one of PROFILES: 'fast', 'default', 'full').
+
+        If update is True, upgrade an existing report in-place,
+        only running collectors that are not already in the report,
+        e.g. to go from a 'fast' report to a 'full' one.
+
+        timeout (seconds), if given, overrides each collector's `timeout`
+        for the subprocesses it runs
+        (by default, 120 seconds per command).
+
+        At most `max_concurrency` collectors run at a time.
+        Subprocesses inherit this report's $PATH via `env`,
+        so reports for several environments can be collected
+        concurrently on one event loop.
+        """
+        if profile not in PROFILES:
+            raise ValueError(
+                f"profile must be one of {sorted(PROFILES)}, not {profile!r}"
+            )
+        max_cost = PROFILES[profile]
+        if not (update and hasattr(self, "collectors")):
+            self.collect_date = datetime.now(timezone.utc).isoformat()
+            self.collectors = {}
+            self.profiles = {}
+        new_collectors = []
+        # detect is cheap and synchronous;
+        # capture the environment to collect with while we're at it
+        with self._env_context():
+            env = dict(os.environ)
+            for collector_class in sorted(
+                self._collector_classes.values(),
+                key=lambda cls: (cls.level, cls.name),
+            ):
+                if collector_class.name in self.collectors:
+                    continue
+                if collector_class.cost > max_cost:
+                    log.debug(
+                        f"Not collecting {collector_class.name} with profile {profile}"
+                    )
+                    continue
+                try:
+                    collector = collector_class(path=self.path)
+                    if not collector.detect():
+                        log.debug(f"Not collecting {collector.name}")
+                        continue
+                except Exception:
+                    log.exception(f"Error in {collector_class.name} collector")
                     continue
+                if timeout is not None:
+                    collector.timeout = timeout
+                self.collectors[collector.name] = collector
+                self.profiles[collector.name] = profile
+                new_collectors.append(collector)
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def collect_one(collector):
+            async with semaphore:
                 log.info(f"Collecting {collector.name}")
-                collector._cached_collect()
-            except Exception:
-                log.exception(f"Error in {collector.name} collector")
-            self.collectors[collector.name] = collector
+                try:
+                    await collector._cached_acollect(env)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception(f"Error in {collector.name} collector")
+
+        await asyncio.gather(*(collect_one(collector) for collector in new_collectors))
 
     def to_dict(self):
         """Convert env-report to JSONable dict
@@ -567,6 +1759,7 @@ class EnvReport:
             "path": str(self.path),
             "collect_date": self.collect_date,
             "envreport_version": self.envreport_version,
+            "profiles": self.profiles,
             "collectors": {
                 name: collector.to_dict() for name, collector in self.collectors.items()
             },
@@ -609,6 +1802,7 @@ class EnvReport:
         self = cls(path=d["path"])
         self.envreport_version = d.get("envreport_version", "unknown")
         self.collect_date = d.get("collect_date", "unknown")
+        self.profiles = d.get("profiles", {})
         self.collectors = {}
         for name, collector_dict in d["collectors"].items():
             if name in self._collector_classes:
@@ -622,13 +1816,26 @@ class EnvReport:
         """Return a JSON report"""
         return json.dumps(self.to_dict(), indent=1, sort_keys=True)
 
-    def text_report(self):
-        """Return a text report"""
+    def text_report(self, collectors=None):
+        """Return a text report
+
+        collectors: optional collection of collector names to include.
+        If unspecified, all collected sections are rendered.
+        """
         lines = []
         lines.append(f"# env report: {self.path}")
         lines.append("")
         lines.append(f"- collected on: {self.collect_date}")
         lines.append(f"- envreport version: {self.envreport_version}")
+        collected_by_profile = {}
+        for name, profile in sorted(self.profiles.items()):
+            if collectors is None or name in collectors:
+                collected_by_profile.setdefault(profile, []).append(name)
+        for profile in sorted(
+            collected_by_profile, key=lambda profile: PROFILES.get(profile, 0)
+        ):
+            names = ", ".join(collected_by_profile[profile])
+            lines.append(f"- profile {profile}: {names}")
         path_replacements = [
             ("PREFIX", str(self.path)),
         ]
@@ -645,14 +1852,21 @@ class EnvReport:
             lines.append(f"- {name}: {path}")
         lines.append("")
 
+        if collectors is None:
+            selected = self.collectors.values()
+        else:
+            unknown = set(collectors).difference(self.collectors)
+            if unknown:
+                raise KeyError(f"No such collectors in report: {sorted(unknown)}")
+            selected = [self.collectors[name] for name in collectors]
+
         for collector in sorted(
-            self.collectors.values(),
+            selected,
             key=lambda collector: (collector.level, collector.name),
         ):
             lines.append(f"## {collector.name}")
             lines.append("")
-            text = collector.get_text_report()
-            text = _squash_paths(text, path_replacements)
+            text = collector.render_text(path_replacements)
             details = collector.details or (len(text) > 1024)
             if details:
                 lines.append("<details>")
@@ -669,6 +1883,283 @@ class EnvReport:
         return "\n".join(lines)
 
 
+class EnvReportHistory:
+    """
+    An append-only history of reports for a single environment
+
+    Stored in a directory with two files:
+
+    - `log.jsonl`: one entry per recorded report.
+      Every `checkpoint_interval` entries store the full report (a checkpoint);
+      other entries store only the collectors that changed
+      since the previous report.
+    - `index.jsonl`: one small record per entry,
+      with the offset of the entry in the log,
+      which collectors changed,
+      and which packages changed version.
+
+    Snapshots are reconstructed from the nearest checkpoint,
+    and package-change queries only read the index.
+
+    ```python
+    history = EnvReportHistory("envreport-history")
+    history.append(report)
+    history.snapshot(-1).save("latest.md")
+    ```
+    """
+
+    log_name = "log.jsonl"
+    index_name = "index.jsonl"
+    lock_name = "lock"
+
+    def __init__(self, directory, checkpoint_interval=10):
+        """
+        Construct history object
+
+        directory: Path where the history is stored
+        checkpoint_interval: store a full snapshot every this many entries
+        """
+        self.directory = Path(directory)
+        self.checkpoint_interval = checkpoint_interval
+
+    @property
+    def _log_path(self):
+        return self.directory / self.log_name
+
+    @property
+    def _index_path(self):
+        return self.directory / self.index_name
+
+    def entries(self):
+        """Return the list of index records, oldest first"""
+        if not self._index_path.exists():
+            return []
+        with self._index_path.open() as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _read_entries(self, index_records):
+        """Read log entries for the given index records"""
+        with self._log_path.open("rb") as f:
+            for record in index_records:
+                f.seek(record["offset"])
+                yield json.loads(f.readline().decode("utf8"))
+
+    def _resolve_seq(self, index, seq):
+        """Resolve a (possibly negative) sequence number to an index position"""
+        if not index:
+            raise IndexError(f"No reports in history at {self.directory}")
+        if seq < 0:
+            seq += len(index)
+        if not 0 <= seq < len(index):
+            raise IndexError(f"No report {seq} in history at {self.directory}")
+        return seq
+
+    def snapshot_dict(self, seq=-1):
+        """Reconstruct the report dict for entry `seq`
+
+        Negative values count from the most recent entry.
+        """
+        index = self.entries()
+        return self._snapshot_dict(index, self._resolve_seq(index, seq))
+
+    def _snapshot_dict(self, index, seq):
+        start = seq
+        while not index[start]["checkpoint"]:
+            start -= 1
+        snapshot = None
+        for entry in self._read_entries(index[start : seq + 1]):
+            if snapshot is None:
+                snapshot = entry["report"]
+                continue
+            report = entry["report"]
+            collectors = dict(snapshot["collectors"])
+            for name in entry["removed"]:
+                collectors.pop(name, None)
+            collectors.update(report["collectors"])
+            report["collectors"] = collectors
+            snapshot = report
+        return snapshot
+
+    def snapshot(self, seq=-1):
+        """Reconstruct the EnvReport for entry `seq`"""
+        return EnvReport.from_dict(self.snapshot_dict(seq))
+
+    @contextmanager
+    def _lock(self):
+        """Hold an exclusive lock on the history
+
+        Prevents concurrent appends from writing the same entry number.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with (self.directory / self.lock_name).open("a+") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        # LK_LOCK gives up after 10 seconds
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def append(self, report):
+        """Record a report in the history
+
+        Safe to call from concurrent processes.
+        Collectors that the report's profile didn't run
+        keep their state from the previous report.
+        Returns the new index record.
+        """
+        report_dict = json.loads(report.json_report())
+        # collectors too expensive for the profile(s) this report was collected with
+        max_cost = max(
+            (
+                PROFILES[profile]
+                for profile in report.profiles.values()
+                if profile in PROFILES
+            ),
+            default=None,
+        )
+        if max_cost is None:
+            skipped = set()
+        else:
+            skipped = {
+                name
+                for name, collector_class in report._collector_classes.items()
+                if collector_class.cost > max_cost
+            }
+        with self._lock():
+            return self._append(report_dict, skipped)
+
+    def _append(self, report_dict, skipped=()):
+        """Append a report dict, with the lock held
+
+        Collectors in `skipped` were not run for this report's profile.
+        They are carried forward from the previous snapshot,
+        rather than recorded as removed.
+        """
+        index = self.entries()
+        previous = None
+        if index:
+            previous = self._snapshot_dict(index, len(index) - 1)
+            if previous["path"] != report_dict["path"]:
+                raise ValueError(
+                    f"History at {self.directory} is for {previous['path']},"
+                    f" not {report_dict['path']}"
+                )
+        seq = len(index)
+        checkpoint = seq % self.checkpoint_interval == 0
+        collectors = report_dict["collectors"]
+        previous_collectors = previous["collectors"] if previous else {}
+        profiles = report_dict.setdefault("profiles", {})
+        for name in skipped:
+            if name in previous_collectors and name not in collectors:
+                collectors[name] = previous_collectors[name]
+                previous_profile = previous.get("profiles", {}).get(name)
+                if previous_profile:
+                    profiles[name] = previous_profile
+        changed = sorted(
+            name
+            for name, collector in collectors.items()
+            if previous_collectors.get(name) != collector
+        )
+        removed = sorted(set(previous_collectors).difference(collectors))
+        entry = {
+            "seq": seq,
+            "checkpoint": checkpoint,
+            "removed": [] if checkpoint else removed,
+            "report": dict(report_dict),
+        }
+        if not checkpoint:
+            entry["report"]["collectors"] = {name: collectors[name] for name in changed}
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._log_path.open("ab") as f:
+            offset = f.tell()
+            f.write(json.dumps(entry, sort_keys=True).encode("utf8") + b"\n")
+
+        record = {
+            "seq": seq,
+            "offset": offset,
+            "checkpoint": checkpoint,
+            "collect_date": report_dict.get("collect_date", "unknown"),
+            "changed": changed,
+            "removed": removed,
+            # the first report has nothing to compare to
+            "packages": (
+                _package_changes(previous_collectors, collectors, changed)
+                if previous
+                else {}
+            ),
+        }
+        with self._index_path.open("a") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+        return record
+
+    def package_history(self, name):
+        """Return when package `name` changed version
+
+        Only reads the index.
+        Returns a list of dicts with keys
+        seq, collect_date, collector, old, new
+        (old or new are None if the package was added or removed).
+        Packages present in the first report are not listed as changes.
+        """
+        names = {name, _canonical_name(name)}
+        changes = []
+        for record in self.entries():
+            for collector_name, packages in sorted(record["packages"].items()):
+                for package_name in names.intersection(packages):
+                    old, new = packages[package_name]
+                    changes.append(
+                        {
+                            "seq": record["seq"],
+                            "collect_date": record["collect_date"],
+                            "collector": collector_name,
+                            "old": old,
+                            "new": new,
+                        }
+                    )
+        return changes
+
+
+def _package_versions(collector_dict):
+    """Get {name: version} from a serialized PackageListCollector, if it has one"""
+    if not collector_dict or "packages" not in collector_dict.get("collected", {}):
+        return None
+    packages = PackageTable.from_dict(collector_dict["collected"]["packages"])
+    return dict(zip(packages.name, packages.version))
+
+
+def _package_changes(before, after, changed):
+    """Compute {collector: {package: [old, new]}} for changed package lists"""
+    changes = {}
+    for name in changed:
+        new_versions = _package_versions(after.get(name))
+        if new_versions is None:
+            continue
+        old_versions = _package_versions(before.get(name)) or {}
+        collector_changes = {}
+        for package in set(old_versions).union(new_versions):
+            old = old_versions.get(package)
+            new = new_versions.get(package)
+            if old != new:
+                collector_changes[package] = [old, new]
+        if collector_changes:
+            changes[name] = collector_changes
+    return changes
+
+
 def discover_path():
     """Discover currently active environment path
 
@@ -695,15 +2186,18 @@ def discover_path():
 
 def main():
     """main entrypoint"""
+    argv = sys.argv[1:]
+    if argv[:1] == ["history"]:
+        return history_main(argv[1:])
     parser = _make_arg_parser()
-    args = parser.parse_args(sys.argv[1:])
+    args = parser.parse_args(argv)
 
     logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
     path = None
     if args.prefix:
         path = args.prefix
     reporter = EnvReport(path)
-    reporter.collect()
+    reporter.collect(profile=args.profile_set)
     if args.format == "markdown":
         report = reporter.text_report()
     elif args.format == "json":
@@ -713,12 +2207,106 @@ def main():
     print(report)
 
 
-def _make_arg_parser(**kwargs):
-    """Construct teh ArgumentParser
+def history_main(argv):
+    """`envreport history` entrypoint"""
+    parser = _make_history_arg_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    history = EnvReportHistory(args.dir)
 
-    shared by %envreport magic and cli
-    """
-    parser = argparse.ArgumentParser(description=__doc__, **kwargs)
+    if args.action == "record":
+        if args.from_json:
+            reporter = EnvReport.from_file(args.from_json)
+        else:
+            reporter = EnvReport(args.prefix)
+            reporter.collect(profile=args.profile_set)
+        try:
+            record = history.append(reporter)
+        except ValueError as e:
+            parser.error(str(e))
+        changed = ", ".join(record["changed"]) or "nothing"
+        print(f"Recorded report {record['seq']} ({changed} changed)")
+    elif args.action == "list":
+        for record in history.entries():
+            kind = "checkpoint" if record["checkpoint"] else "delta"
+            changed = ", ".join(record["changed"]) or "-"
+            print(f"{record['seq']}\t{record['collect_date']}\t{kind}\t{changed}")
+    elif args.action == "show":
+        try:
+            reporter = history.snapshot(args.seq)
+        except IndexError as e:
+            parser.error(str(e))
+        if args.format == "markdown":
+            print(reporter.text_report())
+        else:
+            print(reporter.json_report())
+    elif args.action == "package":
+        for change in history.package_history(args.package):
+            old = change["old"] or "(not installed)"
+            new = change["new"] or "(removed)"
+            print(
+                f"{change['seq']}\t{change['collect_date']}\t"
+                f"{change['collector']}: {old} -> {new}"
+            )
+    else:
+        raise ValueError(f"Invalid history action: {args.action}")
+
+
+def _make_history_arg_parser():
+    """Construct the ArgumentParser for `envreport history`"""
+    parser = argparse.ArgumentParser(
+        prog="envreport history",
+        description="Record and inspect the history of reports for an environment",
+    )
+    _add_logging_arguments(parser)
+    parser.add_argument(
+        "-d",
+        "--dir",
+        default="envreport-history",
+        help="Directory where the history is stored. Default: ./envreport-history",
+    )
+    subparsers = parser.add_subparsers(dest="action")
+    subparsers.required = True
+
+    record = subparsers.add_parser("record", help="Collect and record a report")
+    record.add_argument(
+        "--from-json",
+        help="Record an existing JSON report instead of collecting a new one",
+    )
+    _add_profile_argument(record)
+    record.add_argument(
+        "prefix",
+        nargs="?",
+        help="The environment prefix to report on. Default: use $PATH",
+    )
+
+    subparsers.add_parser("list", help="List recorded reports")
+
+    show = subparsers.add_parser("show", help="Show a recorded report")
+    show.add_argument(
+        "seq",
+        type=int,
+        nargs="?",
+        default=-1,
+        help="The report number to show. Negative numbers count from the end. Default: latest",
+    )
+    show.add_argument(
+        "-f",
+        "--format",
+        choices=["markdown", "json"],
+        default="markdown",
+        help="Format to render output",
+    )
+
+    package = subparsers.add_parser(
+        "package", help="Show when a package changed version"
+    )
+    package.add_argument("package", help="The package name")
+    return parser
+
+
+def _add_logging_arguments(parser):
+    """Add -v/--verbose and -q/--quiet to an ArgumentParser"""
     parser.add_argument(
         "-v",
         "--verbose",
@@ -736,6 +2324,25 @@ def _make_arg_parser(**kwargs):
         const=logging.ERROR,
         help="Less verbose logging output",
     )
+
+
+def _add_profile_argument(parser):
+    """Add --profile-set to an ArgumentParser"""
+    parser.add_argument(
+        "--profile-set",
+        choices=list(PROFILES),
+        default="default",
+        help="Which collectors to run: fast (in-process only), default, or full (including expensive checks)",
+    )
+
+
+def _make_arg_parser(**kwargs):
+    """Construct teh ArgumentParser
+
+    shared by %envreport magic and cli
+    """
+    parser = argparse.ArgumentParser(description=__doc__, **kwargs)
+    _add_logging_arguments(parser)
     parser.add_argument(
         "-f",
         "--format",
@@ -743,6 +2350,7 @@ def _make_arg_parser(**kwargs):
         default="markdown",
         help="Format to render output",
     )
+    _add_profile_argument(parser)
     parser.add_argument(
         "prefix",
         nargs="?",
@@ -755,7 +2363,9 @@ def _envreport_magic(line):
     """
     Produce and display an environment report
 
-    usage: %envreport [-v] [-q] [-f {markdown,json}] [--plain] [prefix]
+    usage: %envreport [-v] [-q] [-f {markdown,json}]
+                      [--profile-set {fast,default,full}] [--plain]
+                      [prefix]
 
     envreport diffable environment reports
 
@@ -768,6 +2378,9 @@ def _envreport_magic(line):
       -q, --quiet           Less verbose logging output
       -f {markdown,json}, --format {markdown,json}
                             Format to render output
+      --profile-set {fast,default,full}
+                            Which collectors to run: fast (in-process only),
+                            default, or full (including expensive checks)
       --plain               Force plain text output (default in terminals)
     """
     import shlex
@@ -794,7 +2407,7 @@ def _envreport_magic(line):
         plain = not getattr(get_ipython(), "kernel", None)
     prefix = args.prefix or sys.prefix
     reporter = EnvReport(prefix)
-    reporter.collect()
+    reporter.collect(profile=args.profile_set)
     if args.format == "markdown":
         report = reporter.text_report()
         if plain:
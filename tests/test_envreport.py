@@ -1,4 +1,26 @@
-from envreport import EnvReport, main
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+from envreport import (
+    EnvReport,
+    EnvReportHistory,
+    PackageTable,
+    RecordCollector,
+    ResourcesCollector,
+    _run_sync,
+    acollect_command_output,
+    collect_command_output,
+    main,
+)
 
 
 def test_main(capsys):
@@ -16,3 +38,411 @@ def test_dict_roundtrip():
     report2 = EnvReport.from_dict(report_dict)
     report_text_2 = report2.text_report()
     assert report_text == report_text_2
+
+
+def test_text_report_subset(monkeypatch):
+    report = EnvReport()
+    report.collect()
+    calls = {"env": 0, "which": 0}
+    for name in calls:
+        collector = report.collectors[name]
+
+        def counting_get_text_report(collector=collector, name=name):
+            calls[name] += 1
+            return type(collector).get_text_report(collector)
+
+        monkeypatch.setattr(collector, "get_text_report", counting_get_text_report)
+
+    full_text = report.text_report()
+    assert calls == {"env": 1, "which": 1}
+    # rendering again uses memoized sections
+    assert report.text_report() == full_text
+    assert calls == {"env": 1, "which": 1}
+    report_text = report.text_report(collectors=["env"])
+    assert "## env" in report_text
+    assert "## which" not in report_text
+    assert calls == {"env": 1, "which": 1}
+    # assigning collected invalidates the cache
+    env = report.collectors["env"]
+    env.collected = {"LANG": "xx_XX"}
+    assert "LANG=xx_XX" in report.text_report(collectors=["env"])
+    assert calls["env"] == 2
+    # in-place changes require explicit invalidation
+    env.collected["LANG"] = "yy_YY"
+    assert "LANG=xx_XX" in report.text_report(collectors=["env"])
+    assert calls["env"] == 2
+    env.invalidate_text_cache()
+    assert "LANG=yy_YY" in report.text_report(collectors=["env"])
+    assert calls["env"] == 3
+
+
+def test_acollect():
+    report = EnvReport()
+    _run_sync(report.acollect(max_concurrency=2))
+    assert "env" in report.collectors
+    assert report.text_report()
+
+
+def test_collect_in_running_loop():
+    async def collect():
+        report = EnvReport()
+        # sync collect() works while a loop is running, e.g. in IPython
+        report.collect()
+        return report
+
+    report = _run_sync(collect())
+    assert "env" in report.collectors
+    # commands ran successfully in the worker thread
+    hostname_output = report.collectors["system-report"].collected["commands"][0]
+    assert hostname_output["command"] == ["hostname"]
+    assert socket.gethostname().split(".")[0] in hostname_output["output"]
+
+
+def test_collect_preserves_event_loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        report = EnvReport()
+        report.collect()
+        assert asyncio.get_event_loop() is loop
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def test_acollect_command_output_timeout():
+    cmd = [sys.executable, "-c", "import time; time.sleep(30)"]
+    tic = time.perf_counter()
+    output = _run_sync(acollect_command_output(cmd, timeout=0.5))
+    assert time.perf_counter() - tic < 10
+    assert "Timeout" in output
+
+
+def test_collect_command_output_truncated():
+    cmd = [
+        sys.executable,
+        "-c",
+        "import sys; sys.stdout.buffer.write(b'a' * 5000 + b'\\xff' + b'z' * 5000)",
+    ]
+    output = collect_command_output(cmd, max_bytes=1000)
+    assert output.startswith("a" * 500)
+    assert output.endswith("z" * 500)
+    assert "truncated 9001 of 10001 bytes" in output
+    # invalid bytes are replaced
+    output = collect_command_output(cmd, max_bytes=None)
+    assert "�" in output
+    assert len(output) == 10001
+    async_output = _run_sync(acollect_command_output(cmd, max_bytes=None))
+    assert async_output == output
+
+
+def test_collect_command_output_spill():
+    cmd = [sys.executable, "-c", "print('x' * 100)"]
+    output = collect_command_output(cmd, max_bytes=10, spill=True)
+    assert "full output saved to" in output
+    spill_path = output.rsplit("full output saved to ", 1)[1].rstrip("]")
+    with open(spill_path) as f:
+        assert f.read().strip() == "x" * 100
+    os.remove(spill_path)
+
+
+def test_package_table_roundtrip():
+    table = PackageTable.from_records(
+        [
+            {"name": "zope-interface", "version": "6.0", "installer": "pip"},
+            {"name": "attrs", "version": "23.1", "installer": "pip"},
+        ]
+    )
+    assert table.name == ["attrs", "zope-interface"]
+    d = table.to_dict()
+    assert d["installer"] == "pip"
+    assert d["build"] == ""
+    assert PackageTable.from_dict(json.loads(json.dumps(d))) == table
+    assert list(table.records())[0] == {
+        "name": "attrs",
+        "version": "23.1",
+        "build": "",
+        "channel": "",
+        "installer": "pip",
+    }
+
+
+def test_pip_packages():
+    report = EnvReport()
+    report.collect()
+    pip = report.collectors["pip"]
+    assert isinstance(pip.collected["packages"], PackageTable)
+    assert "pip" in pip.collected["packages"].name
+    pip_text = report.text_report(collectors=["pip"])
+    assert "Package" in pip_text
+    report2 = EnvReport.from_dict(json.loads(report.json_report()))
+    assert report2.collectors["pip"].collected["packages"] == pip.collected["packages"]
+
+
+def test_history(tmp_path):
+    history = EnvReportHistory(tmp_path / "history", checkpoint_interval=2)
+    report = EnvReport()
+    report.collect()
+    pip = report.collectors["pip"]
+    packages = pip.collected["packages"]
+    for version in ("1.0", "1.0", "2.0"):
+        pip.collected = dict(
+            pip.collected,
+            packages=PackageTable(
+                name=packages.name + ["zzz-test"],
+                version=packages.version + [version],
+            ),
+        )
+        history.append(report)
+    entries = history.entries()
+    assert [e["checkpoint"] for e in entries] == [True, False, True]
+    assert entries[1]["changed"] == []
+    assert entries[2]["changed"] == ["pip"]
+    changes = history.package_history("zzz_test")
+    assert [(c["seq"], c["old"], c["new"]) for c in changes] == [
+        (2, "1.0", "2.0"),
+    ]
+    snapshot = history.snapshot(1)
+    assert snapshot.text_report() == EnvReport.from_dict(
+        history.snapshot_dict(0)
+    ).text_report().replace(entries[0]["collect_date"], entries[1]["collect_date"])
+    assert "zzz-test" in history.snapshot().text_report(collectors=["pip"])
+
+
+def _record_line(site_packages, rel_path):
+    data = (site_packages / rel_path).read_bytes()
+    digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b"=")
+    return f"{rel_path},sha256={digest.decode()},{len(data)}"
+
+
+def test_record_collector(tmp_path):
+    prefix = tmp_path / "env"
+    site_packages = prefix / "lib" / "python3.99" / "site-packages"
+    pkg = site_packages / "pkg"
+    pkg.mkdir(parents=True)
+    for name in ("__init__.py", "a.py", "b.py"):
+        (pkg / name).write_text(f"# {name}\n")
+    dist_info = site_packages / "pkg-1.0.dist-info"
+    dist_info.mkdir()
+    (dist_info / "RECORD").write_text(
+        "\n".join(
+            [
+                _record_line(site_packages, f"pkg/{name}")
+                for name in ("__init__.py", "a.py", "b.py")
+            ]
+            + ["pkg-1.0.dist-info/RECORD,,"]
+        )
+    )
+
+    collector = RecordCollector(prefix)
+    collector.cache_dir = tmp_path / "cache"
+    assert collector.detect()
+    collector.collect()
+    (summary,) = collector.collected["site-packages"]
+    assert summary["files"] == 3
+    assert summary["modified"] == summary["missing"] == summary["unrecorded"] == []
+    (cache_file,) = (tmp_path / "cache").iterdir()
+    assert len(json.loads(cache_file.read_text())) == 3
+
+    (pkg / "a.py").write_text("# changed!\n")
+    (pkg / "b.py").unlink()
+    (pkg / "extra.py").write_text("")
+    # collected in an executor, and re-verified rather than reusing cached results
+    _run_sync(collector._cached_acollect())
+    (summary,) = collector.collected["site-packages"]
+    assert summary["modified"] == ["pkg-1.0: pkg/a.py"]
+    assert summary["missing"] == ["pkg-1.0: pkg/b.py"]
+    assert summary["unrecorded"] == [os.path.join("pkg", "extra.py")]
+    assert "modified: 1" in collector.get_text_report()
+
+
+def test_resources_collector(tmp_path):
+    proc = tmp_path / "proc"
+    (proc / "self").mkdir(parents=True)
+    (proc / "cpuinfo").write_text(
+        "processor\t: 0\nmodel name\t: Test CPU\nphysical id\t: 0\ncore id\t: 0\n\n"
+        "processor\t: 1\nmodel name\t: Test CPU\nphysical id\t: 0\ncore id\t: 0\n"
+    )
+    (proc / "meminfo").write_text(
+        "MemTotal:       16777216 kB\nMemFree:  1 kB\nMemAvailable:    8000000 kB\n"
+    )
+    (proc / "loadavg").write_text("9.62 4.40 0.10 2/72 5095\n")
+    (proc / "self" / "cgroup").write_text("0::/job\n")
+    cgroup = tmp_path / "sys" / "fs" / "cgroup"
+    (cgroup / "job").mkdir(parents=True)
+    (cgroup / "cgroup.controllers").write_text("cpu memory\n")
+    (cgroup / "job" / "cpu.max").write_text("200000 100000\n")
+    (cgroup / "job" / "memory.max").write_text(f"{4 * 1024**3}\n")
+    (cgroup / "job" / "cpu.stat").write_text("usage_usec 10\nnr_throttled 3\n")
+
+    collector = ResourcesCollector("/")
+    collector.proc_root = str(proc)
+    collector.sys_root = str(tmp_path / "sys")
+    assert collector.detect()
+    collector.collect()
+    collected = collector.collected
+    assert collected["cpu"]["model"] == "Test CPU"
+    assert collected["cpu"]["processors"] == 2
+    assert collected["cpu"]["cores"] == 1
+    assert collected["memory"]["MemTotal"] == 16 * 1024**3
+    assert "MemAvailable" not in collected["memory"]
+    assert collected["load"] == "low"
+    assert collected["cgroup"] == {
+        "version": 2,
+        "cpu_limit": 2.0,
+        "memory_limit": 4 * 1024**3,
+        "throttled": True,
+    }
+    text = collector.get_text_report()
+    assert "cgroup memory limit: 4.0 GiB" in text
+
+
+def test_profiles():
+    report = EnvReport()
+    report.collect(profile="fast")
+    assert "env" in report.collectors
+    assert "pip" not in report.collectors
+    assert set(report.profiles.values()) == {"fast"}
+    env_collector = report.collectors["env"]
+    report.collect(profile="default", update=True)
+    assert "pip" in report.collectors
+    assert report.collectors["env"] is env_collector
+    assert report.profiles["env"] == "fast"
+    assert report.profiles["pip"] == "default"
+    report_text = report.text_report()
+    assert "- profile fast: " in report_text
+    assert "- profile default: " in report_text
+    report2 = EnvReport.from_dict(report.to_dict())
+    assert report2.text_report() == report_text
+
+
+def test_history_concurrent_append(tmp_path):
+    history = EnvReportHistory(tmp_path / "history")
+    report = EnvReport()
+    report.collect(profile="fast")
+    threads = [
+        threading.Thread(target=history.append, args=(report,)) for i in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [entry["seq"] for entry in history.entries()] == list(range(8))
+
+
+def test_history_show_empty(tmp_path, monkeypatch, capsys):
+    history_dir = str(tmp_path / "history")
+    monkeypatch.setattr(
+        sys, "argv", ["envreport", "history", "-d", history_dir, "show"]
+    )
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+    assert exc_info.value.code == 2
+    assert "No reports in history" in capsys.readouterr().err
+
+
+def test_history_record_profile(tmp_path, monkeypatch, capsys):
+    history_dir = tmp_path / "history"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "envreport",
+            "history",
+            "-d",
+            str(history_dir),
+            "record",
+            "--profile-set",
+            "fast",
+        ],
+    )
+    main()
+    snapshot = EnvReportHistory(history_dir).snapshot()
+    assert set(snapshot.profiles.values()) == {"fast"}
+    assert "pip" not in snapshot.collectors
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="uses os.kill(pid, 0)")
+def test_acollect_command_output_cancel_reaps(tmp_path):
+    pid_file = tmp_path / "pid"
+    cmd = [
+        sys.executable,
+        "-c",
+        f"import os, time; open({str(pid_file)!r}, 'w').write(str(os.getpid())); time.sleep(30)",
+    ]
+
+    async def cancel_collect():
+        task = asyncio.ensure_future(acollect_command_output(cmd))
+        while not pid_file.exists() or not pid_file.read_text():
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    _run_sync(cancel_collect())
+    pid = int(pid_file.read_text())
+    # reaped processes are gone entirely, not zombies
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+
+
+def test_collect_timeout():
+    report = EnvReport()
+    report.collect(timeout=60)
+    assert report.collectors["pip"].timeout == 60
+    assert type(report.collectors["pip"]).timeout == 120
+
+
+def test_record_collector_absolute_path(tmp_path, monkeypatch):
+    prefix = tmp_path / "env"
+    site_packages = prefix / "lib" / "python3.99" / "site-packages"
+    (site_packages / "pkg").mkdir(parents=True)
+    (site_packages / "pkg" / "__init__.py").write_text("")
+    readme = tmp_path / "share" / "doc" / "pkg" / "README"
+    readme.parent.mkdir(parents=True)
+    readme.write_text("readme\n")
+    dist_info = site_packages / "pkg-1.0.dist-info"
+    dist_info.mkdir()
+    (dist_info / "RECORD").write_text(
+        "\n".join(
+            [
+                _record_line(site_packages, "pkg/__init__.py"),
+                f"{readme},,",
+                "pkg-1.0.dist-info/RECORD,,",
+            ]
+        )
+    )
+
+    walked = []
+    real_walk = os.walk
+
+    def recording_walk(top, *args, **kwargs):
+        walked.append(top)
+        return real_walk(top, *args, **kwargs)
+
+    monkeypatch.setattr(os, "walk", recording_walk)
+    collector = RecordCollector(prefix)
+    collector.cache_dir = tmp_path / "cache"
+    collector.collect()
+    (summary,) = collector.collected["site-packages"]
+    assert summary["unrecorded"] == []
+    assert walked == [str(site_packages / "pkg")]
+
+
+def test_history_mixed_profiles(tmp_path):
+    history = EnvReportHistory(tmp_path / "history", checkpoint_interval=2)
+    for profile in ("default", "fast", "fast", "default"):
+        report = EnvReport()
+        report.collect(profile=profile)
+        history.append(report)
+    entries = history.entries()
+    assert [e["checkpoint"] for e in entries] == [True, False, True, False]
+    for entry in entries[1:]:
+        assert entry["removed"] == []
+        assert "pip" not in entry["changed"]
+    assert history.package_history("pip") == []
+    # pip is carried forward through the fast reports, including checkpoints
+    snapshot = history.snapshot(2)
+    assert "pip" in snapshot.collectors
+    assert snapshot.profiles["pip"] == "default"
+    assert snapshot.profiles["env"] == "fast"